@@ -1,17 +1,13 @@
 import numpy as np
-from scipy.signal import convolve2d
-from dataclasses import dataclass
 from typing import Any, TypeAlias, Literal
 
-@dataclass
-class State:
-    """State of the game"""
-    board: np.ndarray[Any, np.dtype[np.int8]]
+from _engine import apply_move, undo_move, wins_through
 
-@dataclass
-class Observation:
-    """Observation by a single player of the game"""
-    board: np.ndarray[Any, np.dtype[np.int8]]
+# State of the game
+State:TypeAlias = np.ndarray[Any, np.dtype[np.int8]]
+
+# Observation by a single player of the game
+Observation:TypeAlias = np.ndarray[Any, np.dtype[np.int8]]
 
 
 # Column to place it in
@@ -31,32 +27,29 @@ Player:TypeAlias = np.int8
 PLAYER1:Player = np.int8(1)
 PLAYER2:Player = np.int8(2)
 
+# PLAYER1 ^ PLAYER2, so xor-ing a player with it gives the other one
+_PLAYERS_XOR:Player = np.int8(3)
+
 def opponent(actor:Player) -> Player:
-    return PLAYER2 if actor == PLAYER1 else PLAYER1
+    return _PLAYERS_XOR ^ actor
 
 def print_obs(o:Observation):
-    for row in reversed(o.board):
-        # We print '#' for our item, and 'O' for the opponent
-        for x in row:
-            c = ' '
-            if x == 1:
-                c = '#'
-            elif x == 2:
-                c = 'O'
-            print(c, end=" ")
-        print()
-    print()
+    # We print '#' for our item, and 'O' for the opponent
+    rows = ["".join(" #O"[x] + " " for x in row) for row in reversed(o)]
+    print("\n".join(rows) + "\n")
 
 def initial_state(dims:tuple[int, int]) -> State:
-    return State(np.zeros(dims, dtype=np.int8))
+    return np.zeros(dims, dtype=np.int8)
+
+# maps board values (empty, player1, player2) to (empty, us, opponent) for player 2
+player2_lut = np.array([0, 2, 1], dtype=np.int8)
 
 def state_to_observation(state: State, actor: np.int8) -> Observation:
-    s = state.board
-    o = s.copy()
-    o[s == actor] = 1
-    o[s != actor] = 2
-    o[s == 0] = 0
-    return Observation(o)
+    # player 1 already sees the board as it is. This is still a copy, since
+    # observations are kept around while the board keeps changing.
+    if actor == PLAYER1:
+        return state.copy()
+    return player2_lut[state]
 
 
 class Env():
@@ -66,14 +59,19 @@ class Env():
     ):
         self._game_over = False
         self._winner = None
-        self._moves = []
         self.state: State = initial_state(dims)
+        # number of pieces in each column
+        self._heights = np.zeros(dims[1], dtype=np.int8)
+        # columns of the moves played so far, only the first _nmoves are valid
+        self._moves = np.empty(dims[0] * dims[1], dtype=np.int8)
+        self._nmoves = 0
 
     def reset(self) -> None:
         self._game_over = False
         self._winner = None
-        self._moves = []
-        self.state = initial_state(self.state.board.shape)
+        self.state = initial_state(self.state.shape)
+        self._heights[:] = 0
+        self._nmoves = 0
 
     def observe(self, actor: np.int8) -> Observation:
         return state_to_observation(self.state, actor)
@@ -85,65 +83,40 @@ class Env():
         return self._winner
 
     def dims(self) -> tuple[int, int]:
-        return self.state.board.shape
+        return self.state.shape
 
     def legal_mask(self) -> np.ndarray[Any, np.dtype[np.bool_]]:
-        return self.state.board[-1] == 0
+        return self._heights < self.state.shape[0]
 
     def legal_actions(self) -> list[Action]:
-        return [Action(i) for i in range(self.dims()[1]) if self.legal_mask()[i]]
+        return [Action(i) for i in np.flatnonzero(self.legal_mask())]
 
     def step(self, a: Action, actor: Player) -> Reward:
         # 1. Assume the move is legal. Modify the game board to reflect the move.
         col = int(a)
-        row = np.argmax(self.state.board[:, col] == 0)
-        self.state.board[row, col] = actor
+        row = apply_move(self.state, self._heights, col, int(actor))
 
         # 1.5 Add the move to self._moves.
-        self._moves.append((row, col))
+        self._moves[self._nmoves] = col
+        self._nmoves += 1
 
         # 2. Check if the game is over. If so, set self._game_over and self._winner.
-        if self.is_game_over(row, col):
+        # Only lines through the last move can have become four in a row
+        if wins_through(self.state, row, col, int(actor)):
             self._game_over = True
             self._winner = actor
+        # A full board without four in a row is a draw
+        elif self._nmoves == self.state.size:
+            self._game_over = True
 
         # 3. Return the reward for the agent.
         if self._game_over and self._winner == actor:
             return 1.0  # Agent wins
-        elif self._game_over and self._winner != actor:
+        elif self._game_over and self._winner is not None:
             return -1.0  # Agent loses
         else:
             return 0.0  # Game continues, no reward
 
-    def is_game_over(self, row: int, col: int) -> bool:
-        board = self.state.board
-
-        # Check for four in a row horizontally
-        horizontal_kernel = np.array([[1, 1, 1, 1]])
-        if np.any(convolve2d(board, horizontal_kernel, mode='valid') >= 4):
-            return True
-
-        # Check for four in a row vertically
-        vertical_kernel = np.array([[1], [1], [1], [1]])
-        if np.any(convolve2d(board, vertical_kernel, mode='valid') >= 4):
-            return True
-
-        # Check for four in a row diagonally (top-left to bottom-right)
-        diag_kernel1 = np.eye(4)
-        if np.any(convolve2d(board, diag_kernel1, mode='valid') >= 4):
-            return True
-
-        # Check for four in a row diagonally (top-right to bottom-left)
-        diag_kernel2 = np.fliplr(diag_kernel1)
-        if np.any(convolve2d(board, diag_kernel2, mode='valid') >= 4):
-            return True
-
-        # Check for a tie (board is full)
-        if np.all(board != 0):
-            return True
-
-        return False
-
     def check_line(self, idx: int, line: np.ndarray) -> bool:
         length = 4
         start = 0
@@ -157,8 +130,9 @@ class Env():
 
     
     def undo(self):
-        if len(self._moves) == 0:
+        if self._nmoves == 0:
             return
-        self.state.board[self._moves.pop()] = 0
+        self._nmoves -= 1
+        undo_move(self.state, self._heights, self._moves[self._nmoves])
         self._winner = None
         self._game_over = False
@@ -59,8 +59,8 @@ class HumanPlayer(Player):
 # this heuristic just counts the number of 4-in-a-rows each player has
 # returns a number between 0 and 1
 def heuristic(e: env.Env) -> float:
-    player1_valid = e.observe(env.PLAYER1).board != env.PLAYER2
-    player2_valid = e.observe(env.PLAYER2).board != env.PLAYER1
+    player1_valid = e.observe(env.PLAYER1) != env.PLAYER2
+    player2_valid = e.observe(env.PLAYER2) != env.PLAYER1
 
     player1_score = 0
     player2_score = 0
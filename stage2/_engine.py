@@ -0,0 +1,135 @@
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    # numba is optional, without it these run as plain python
+    def njit(*args, **kwargs):
+        return lambda f: f
+
+# the standard connect4 board
+ROWS, COLS = 6, 7
+
+
+@njit(cache=True, nogil=True)
+def apply_move(board: np.ndarray, heights: np.ndarray, col: int, actor: int) -> int:
+    """
+    Drops actor's piece into col and returns the row it landed in.
+    Raises ValueError if col is out of range or already full.
+    """
+    # numba doesn't bounds check, so an illegal move would write past the board
+    if col < 0 or col >= board.shape[1] or heights[col] >= board.shape[0]:
+        raise ValueError("illegal move")
+    row = heights[col]
+    board[row, col] = actor
+    heights[col] += 1
+    return row
+
+
+@njit(cache=True, nogil=True)
+def undo_move(board: np.ndarray, heights: np.ndarray, col: int) -> None:
+    """
+    Removes the top piece of col.
+    """
+    heights[col] -= 1
+    board[heights[col], col] = 0
+
+
+@njit(cache=True, nogil=True, inline="always")
+def _wins_through(
+    board: np.ndarray, r: int, c: int, actor: int, rows: int, cols: int
+) -> bool:
+    # horizontal, vertical, and the two diagonals
+    for dr, dc in ((0, 1), (1, 0), (1, 1), (1, -1)):
+        count = 1
+        i, j = r + dr, c + dc
+        while 0 <= i < rows and 0 <= j < cols and board[i, j] == actor:
+            count += 1
+            i += dr
+            j += dc
+        i, j = r - dr, c - dc
+        while 0 <= i < rows and 0 <= j < cols and board[i, j] == actor:
+            count += 1
+            i -= dr
+            j -= dc
+        if count >= 4:
+            return True
+    return False
+
+
+@njit(cache=True, nogil=True)
+def wins_through(board: np.ndarray, r: int, c: int, actor: int) -> bool:
+    """
+    Returns if actor has four in a row on a line through (r, c).
+    Only these lines can have been completed by the piece at (r, c).
+    """
+    rows, cols = board.shape
+    return _wins_through(board, r, c, actor, rows, cols)
+
+
+@njit(cache=True, nogil=True)
+def wins_through_standard(board: np.ndarray, r: int, c: int, actor: int) -> bool:
+    """
+    wins_through for a ROWS x COLS board. The size is inlined as a constant,
+    so the compiler can drop the shape loads and unroll the scan.
+    """
+    return _wins_through(board, r, c, actor, ROWS, COLS)
+
+
+@njit(cache=True, nogil=True)
+def random_playouts(
+    boards: np.ndarray,
+    heights: np.ndarray,
+    game_over: np.ndarray,
+    actor: int,
+    winners: np.ndarray,
+) -> None:
+    """
+    Plays every game that isn't over to the end with uniformly random legal
+    moves, actor moving first, and writes the winner (0 for a draw) to winners.
+    boards and heights are modified in place.
+    """
+    n, rows, cols = boards.shape
+    legal = np.empty(cols, dtype=np.int64)
+    for g in range(n):
+        if game_over[g]:
+            continue
+        board = boards[g]
+        height = heights[g]
+        player = actor
+        winners[g] = 0
+        while True:
+            k = 0
+            for c in range(cols):
+                if height[c] < rows:
+                    legal[k] = c
+                    k += 1
+            # board is full
+            if k == 0:
+                break
+            col = legal[np.random.randint(k)]
+            row = apply_move(board, height, col, player)
+            if _wins_through(board, row, col, player, rows, cols):
+                winners[g] = player
+                break
+            player = 3 - player
+
+
+def _warmup() -> None:
+    # compile everything once at import, so the first game doesn't pay for it
+    board = np.zeros((ROWS, COLS), dtype=np.int8)
+    heights = np.zeros(COLS, dtype=np.int8)
+    row = apply_move(board, heights, 0, 1)
+    wins_through(board, row, 0, 1)
+    wins_through_standard(board, row, 0, 1)
+    undo_move(board, heights, 0)
+    random_playouts(
+        board[None],
+        heights[None],
+        np.zeros(1, dtype=np.bool_),
+        1,
+        np.zeros(1, dtype=np.int8),
+    )
+
+
+_warmup()
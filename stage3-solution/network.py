@@ -15,7 +15,7 @@ ENTROPY_BONUS = 0.1
 
 # (Channel, Width, Height)
 def reshape_board(o: env.Observation) -> np.ndarray:
-    return np.stack([o.board == 1, o.board == 2])
+    return np.stack([o == 1, o == 2])
 
 
 # output in (Batch, Channel, Width, Height)
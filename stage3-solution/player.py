@@ -80,8 +80,8 @@ class RandomPlayer(Player):
 
 # this heuristic just counts the number of 4-in-a-rows each player has
 def heuristic(e: env.Env) -> float:
-    player1_valid = e.observe(env.PLAYER1).board != env.PLAYER2
-    player2_valid = e.observe(env.PLAYER2).board != env.PLAYER1
+    player1_valid = e.observe(env.PLAYER1) != env.PLAYER2
+    player2_valid = e.observe(env.PLAYER2) != env.PLAYER1
 
     player1_score = 0
     player2_score = 0
@@ -1,21 +1,18 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import numpy.typing as npt
-from scipy.signal import convolve2d
 from typing import Any, TypeAlias, Literal
 
-class State:
-    """State of the game"""
-    board: np.ndarray[Any, np.dtype[np.int8]]
+from _engine import (
+    ROWS, COLS, apply_move, undo_move, wins_through, wins_through_standard, random_playouts
+)
 
-    def __init__(self, board:np.ndarray[Any, np.dtype[np.int8]]):
-        self.board = board
+# State of the game
+State:TypeAlias = np.ndarray[Any, np.dtype[np.int8]]
 
-class Observation:
-    """Observation by a single player of the game"""
-    board: np.ndarray[Any, np.dtype[np.int8]]
-
-    def __init__(self, board:np.ndarray[Any, np.dtype[np.int8]]):
-        self.board = board
+# Observation by a single player of the game
+Observation:TypeAlias = np.ndarray[Any, np.dtype[np.int8]]
 
 # Column to place it in
 Action:TypeAlias = np.int8
@@ -34,32 +31,29 @@ Player:TypeAlias = np.int8
 PLAYER1:Player = np.int8(1)
 PLAYER2:Player = np.int8(2)
 
+# PLAYER1 ^ PLAYER2, so xor-ing a player with it gives the other one
+_PLAYERS_XOR:Player = np.int8(3)
+
 def opponent(actor:Player) -> Player:
-    return PLAYER2 if actor == PLAYER1 else PLAYER1
+    return _PLAYERS_XOR ^ actor
 
 def print_obs(o:Observation):
-    for row in reversed(o.board):
-        # We print '#' for our item, and 'O' for the opponent
-        for x in row:
-            c = ' '
-            if x == 1:
-                c = '#'
-            elif x == 2:
-                c = 'O'
-            print(c, end=" ")
-        print()
-    print()
+    # We print '#' for our item, and 'O' for the opponent
+    rows = ["".join(" #O"[x] + " " for x in row) for row in reversed(o)]
+    print("\n".join(rows) + "\n")
 
 def initial_state(dims:tuple[int, int]) -> State:
-    return State(np.zeros(dims, dtype=np.int8))
+    return np.zeros(dims, dtype=np.int8)
+
+# maps board values (empty, player1, player2) to (empty, us, opponent) for player 2
+player2_lut = np.array([0, 2, 1], dtype=np.int8)
 
 def state_to_observation(state: State, actor: np.int8) -> Observation:
-    s = state.board
-    o = s.copy()
-    o[s == actor] = 1
-    o[s != actor] = 2
-    o[s == 0] = 0
-    return Observation(o)
+    # player 1 already sees the board as it is. This is still a copy, since
+    # observations are kept around while the board keeps changing.
+    if actor == PLAYER1:
+        return state.copy()
+    return player2_lut[state]
 
 
 horizontal_kernel = np.array([[ 1, 1, 1, 1]])
@@ -68,43 +62,30 @@ diag1_kernel = np.eye(4, dtype=np.uint8)
 diag2_kernel = np.fliplr(diag1_kernel)
 detection_kernels = [horizontal_kernel, vertical_kernel, diag1_kernel, diag2_kernel]
 
-def is_winner(state:State, actor:Player) -> bool:
-    board = state.board
-    for kernel in detection_kernels:
-        if (convolve2d(board == actor, kernel, mode="valid") == 4).any():
-            return True
-    return False
-
-def drawn(state:State) -> bool:
-    """
-    Returns if the board is completely filled
-    """
-    return 0 not in state.board
-
-# return the reward for the actor
-def state_to_reward(s: State, player: Player) -> Reward:
-    if is_winner(s, player):
-        return np.float32(1.0)
-    elif is_winner(s, opponent(player)):
-        return np.float32(-1.0)
-    else:
-        return np.float32(0.0)
 
 class Env():
+    # checks the lines through a new piece, subclasses can swap in a specialized one
+    _wins_through = staticmethod(wins_through)
+
     def __init__(
         self,
         dims:tuple[int,int]
     ):
         self._game_over = False
         self._winner = None
-        self._moves = []
         self.state: State = initial_state(dims)
+        # number of pieces in each column
+        self._heights = np.zeros(dims[1], dtype=np.int8)
+        # columns of the moves played so far, only the first _nmoves are valid
+        self._moves = np.empty(dims[0] * dims[1], dtype=np.int8)
+        self._nmoves = 0
 
     def reset(self) -> None:
         self._game_over = False
         self._winner = None
-        self._moves = []
-        self.state = initial_state(self.state.board.shape)
+        self.state = initial_state(self.state.shape)
+        self._heights[:] = 0
+        self._nmoves = 0
 
     def observe(self, actor: np.int8) -> Observation:
         return state_to_observation(self.state, actor)
@@ -116,34 +97,166 @@ class Env():
         return self._winner
 
     def dims(self) -> tuple[int, int]:
-        return self.state.board.shape
+        return self.state.shape
 
     def legal_mask(self) -> np.ndarray[Any, np.dtype[np.bool_]]:
-        return self.state.board[-1] == 0
+        return self._heights < self.state.shape[0]
 
     def legal_actions(self) -> list[Action]:
-        return [Action(i) for i in range(self.dims()[1]) if self.legal_mask()[i]]
+        return [Action(i) for i in np.flatnonzero(self.legal_mask())]
 
     def step(self, a: Action, actor: Player) -> Reward:
-        for i,row in enumerate(self.state.board):
-            if row[a] == 0:
-                self._moves.append((i,a))
-                row[a] = actor
-                break
+        col = int(a)
+        row = apply_move(self.state, self._heights, col, int(actor))
+        self._moves[self._nmoves] = col
+        self._nmoves += 1
 
-        r = state_to_reward(self.state, actor)
+        # only the lines through the new piece can have been completed
+        if self._wins_through(self.state, row, col, int(actor)):
+            r = np.float32(1.0)
+        else:
+            r = np.float32(0.0)
 
         if r != 0:
             self._game_over = True
             self._winner = actor
-        elif drawn(self.state):
+        elif self._nmoves == self.state.size:
             self._game_over = True
 
         return r
     
     def undo(self):
-        if len(self._moves) == 0:
+        if self._nmoves == 0:
             return
-        self.state.board[self._moves.pop()] = 0
+        self._nmoves -= 1
+        undo_move(self.state, self._heights, self._moves[self._nmoves])
         self._winner = None
         self._game_over = False
+
+
+class Connect4Env(Env):
+    """
+    Env for the standard 6x7 board, with the win check compiled for that size.
+    Use Env for any other dims.
+    """
+    _wins_through = staticmethod(wins_through_standard)
+
+    def __init__(self):
+        super().__init__((ROWS, COLS))
+
+
+class BatchEnv():
+    """
+    n independent games played in lockstep, so each step is done for all of
+    them with a handful of numpy calls instead of n python calls.
+    """
+    def __init__(
+        self,
+        n:int,
+        dims:tuple[int,int]
+    ):
+        # one bitboard per game and player, cell (row, col) is bit col*(rows+1) + row.
+        # The extra row per column is a gap, so lines can't wrap into the next column.
+        assert (dims[0] + 1) * dims[1] <= 64, "board too large for a uint64 bitboard"
+        h = dims[0] + 1
+        # vertical, horizontal, and the two diagonals
+        self._shifts = np.array([[1], [h], [h - 1], [h + 1]], dtype=np.uint64)
+        self.boards = np.zeros((n, *dims), dtype=np.int8)
+        self._heights = np.zeros((n, dims[1]), dtype=np.int8)
+        self._bb = np.zeros((n, 2), dtype=np.uint64)
+        self._game_over = np.zeros(n, dtype=np.bool_)
+        # 0 where there is no winner
+        self._winner = np.zeros(n, dtype=np.int8)
+
+    def reset(self) -> None:
+        self.boards[:] = 0
+        self._heights[:] = 0
+        self._bb[:] = 0
+        self._game_over[:] = False
+        self._winner[:] = 0
+
+    def observe(self, actor: np.int8) -> np.ndarray[Any, np.dtype[np.int8]]:
+        if actor == PLAYER1:
+            return self.boards.copy()
+        # swap 1 and 2 and leave empty cells alone. Much faster than a table
+        # lookup once there are many boards.
+        return self.boards ^ (np.int8(3) * (self.boards != 0))
+
+    def game_over(self) -> np.ndarray[Any, np.dtype[np.bool_]]:
+        return self._game_over
+
+    def winner(self) -> np.ndarray[Any, np.dtype[np.int8]]:
+        return self._winner
+
+    def dims(self) -> tuple[int, int]:
+        return self.boards.shape[1:]
+
+    def legal_mask(self) -> np.ndarray[Any, np.dtype[np.bool_]]:
+        return self._heights < self.boards.shape[1]
+
+    def step(
+        self,
+        actions: np.ndarray[Any, np.dtype[np.int8]],
+        actor: Player
+    ) -> np.ndarray[Any, np.dtype[np.float32]]:
+        rewards = np.zeros(len(self.boards), dtype=np.float32)
+
+        # games that are already over ignore their action
+        games = np.flatnonzero(~self._game_over)
+        cols = actions[games].astype(np.intp)
+        # reject illegal moves before touching anything, so the boards and
+        # bitboards can't disagree (a negative column would wrap on the boards)
+        n_rows, n_cols = self.boards.shape[1:]
+        if ((cols < 0) | (cols >= n_cols)).any():
+            raise ValueError("illegal move")
+        rows = self._heights[games, cols].astype(np.intp)
+        if (rows >= n_rows).any():
+            raise ValueError("illegal move")
+        self.boards[games, rows, cols] = actor
+        self._heights[games, cols] += 1
+
+        bits = (cols * (self.boards.shape[1] + 1) + rows).astype(np.uint64)
+        b = self._bb[games, actor - 1] | (np.uint64(1) << bits)
+        self._bb[games, actor - 1] = b
+
+        s = self._shifts
+        won = (b & (b >> s) & (b >> np.uint64(2) * s) & (b >> np.uint64(3) * s)).any(axis=0)
+        full = (self._heights[games] == self.boards.shape[1]).all(axis=1)
+
+        self._game_over[games] = won | full
+        self._winner[games[won]] = actor
+        rewards[games[won]] = 1.0
+        return rewards
+
+    def rollout(
+        self,
+        actor: Player,
+        threads: int | None = None
+    ) -> np.ndarray[Any, np.dtype[np.int8]]:
+        """
+        Plays every game out from its current position with uniformly random
+        moves, actor moving first, and returns the winners (0 for a draw).
+        The games themselves are left as they are.
+        """
+        boards = self.boards.copy()
+        heights = self._heights.copy()
+        winners = self._winner.copy()
+
+        n = len(boards)
+        if threads is None:
+            threads = os.cpu_count() or 1
+        threads = max(1, min(n, threads))
+
+        # each thread plays its own slice of the games, and the engine
+        # releases the GIL while it does, so the threads run in parallel
+        bounds = np.linspace(0, n, threads + 1).astype(np.intp)
+
+        def play(a: int, b: int) -> None:
+            random_playouts(
+                boards[a:b], heights[a:b], self._game_over[a:b], int(actor), winners[a:b]
+            )
+
+        with ThreadPoolExecutor(threads) as pool:
+            for f in [pool.submit(play, a, b) for a, b in zip(bounds[:-1], bounds[1:])]:
+                f.result()
+        return winners
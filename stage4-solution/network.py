@@ -17,7 +17,7 @@ PPO_GRAD_DESCENT_STEPS = 10  # Number of gradient descent steps to take on the s
 
 # (Channel, Width, Height)
 def reshape_board(o: env.Observation) -> np.ndarray:
-    return np.stack([o.board == 1, o.board == 2])
+    return np.stack([o == 1, o == 2])
 
 
 # output in (Batch, Channel, Width, Height)
@@ -20,7 +20,7 @@ PPO_GRAD_DESCENT_STEPS = (
 
 # (Channel, Width, Height)
 def reshape_board(o: env.Observation) -> np.ndarray:
-    return np.stack([o.board == 1, o.board == 2])
+    return np.stack([o == 1, o == 2])
 
 
 # output in (Batch, Channel, Width, Height)